@@ -1,16 +1,26 @@
 # main.py
 import os
 import re
-import json
+import logging
+import asyncio
+import hashlib
+from contextlib import asynccontextmanager
 from pathlib import Path
 from typing import Optional
 
+import httpx
+import numpy as np
+import orjson
+from cachetools import TTLCache
 from dotenv import load_dotenv
 from fastapi import FastAPI, HTTPException, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
-from openai import OpenAI
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+logger = logging.getLogger(__name__)
 
 # ------------------------------------------------------------------
 # Env & OpenAI
@@ -22,33 +32,104 @@ ASSISTANT_ID   = os.getenv("ASSISTANT_ID")  # usado no /ask
 if not OPENAI_API_KEY:
     raise ValueError("Defina OPENAI_API_KEY no .env")
 
-client = OpenAI(api_key=OPENAI_API_KEY)
+# Ping periódico à OpenAI (ver _manter_conexao_openai)
+OPENAI_KEEPALIVE_INTERVALO = 240  # segundos
+
+# Limites de conexão padrão do SDK + HTTP/2: vários streams SSE simultâneos
+# multiplexados em poucas conexões. A expiração de keep-alive precisa ser maior
+# que o intervalo do ping, senão a conexão fecha antes do próximo
+client = AsyncOpenAI(
+    api_key=OPENAI_API_KEY,
+    timeout=httpx.Timeout(60.0, connect=5.0),
+    http_client=DefaultAsyncHttpxClient(
+        limits=httpx.Limits(max_connections=1000, max_keepalive_connections=100, keepalive_expiry=OPENAI_KEEPALIVE_INTERVALO + 60),
+        http2=True,
+    ),
+)
+
+# Remove marcações de citação (【...】) das respostas do Assistant
+_CITATION_RE = re.compile(r'【.*?】')
+
+def _remover_citacoes(texto: str) -> str:
+    # Quase nenhum chunk tem citação: evita passar pelo motor de regex à toa
+    if '【' not in texto:
+        return texto
+    return _CITATION_RE.sub('', texto)
+
+_CITACAO_MAX_LEN = 100  # '【' aberto há mais que isso não é citação: libera o texto
+
+class _FiltroCitacoes:
+    """
+    Acumula os deltas do stream só enquanto há uma citação aberta ('【' sem '】'),
+    para removê-la mesmo quando chega dividida entre chunks.
+    """
+
+    def __init__(self):
+        self.pendente = ""
+
+    def adicionar(self, texto: str) -> str:
+        self.pendente += texto
+        abre = self.pendente.rfind('【')
+        if abre != -1 and '】' not in self.pendente[abre:] and len(self.pendente) - abre <= _CITACAO_MAX_LEN:
+            return ""
+        return self.liberar()
+
+    def liberar(self) -> str:
+        texto, self.pendente = self.pendente, ""
+        return _remover_citacoes(texto)
+
+# Envelope SSE pré-codificado dos chunks de texto: só o conteúdo é serializado por evento
+_CHUNK_PREFIX = b'data: {"event":"text_chunk","data":'
+_CHUNK_SUFFIX = b'}\n\n'
+
+_SSE_HEADERS = {
+    "Content-Type": "text/event-stream",
+    "Cache-Control": "no-cache",
+    "Connection": "keep-alive",
+    "X-Accel-Buffering": "no",
+    "Content-Encoding": "identity",
+}
 
 # ------------------------------------------------------------------
-# FastAPI + CORS
+# FastAPI + CORS + GZip
 # ------------------------------------------------------------------
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Tasks em background durante a vida do processo (definidas mais abaixo)
+    reload_equipe_task = asyncio.create_task(_recarregar_equipe_periodicamente())
+    keepalive_openai_task = asyncio.create_task(_manter_conexao_openai())
+    yield
+    reload_equipe_task.cancel()
+    keepalive_openai_task.cancel()
+    await client.close()
+
 app = FastAPI(
+    lifespan=lifespan,
     title="Atlas.AI API",
     description="Admin + consultas (local e Assistants API) em um único arquivo.",
     version="1.0.0",
 )
 
-origins = [
+# Origins do navegador nunca têm barra final; subdomínios de matheussilvano.dev via regex
+ORIGINS = (
     "http://localhost",
     "http://localhost:8080",
     "http://127.0.0.1:5500",
     "https://matheussilvano.github.io",
     "https://www.matheussilvano.dev",
-    "https://matheus-silvano.vercel.app/",
-    "matheussilvano.dev",
+    "https://matheus-silvano.vercel.app",
     "https://promoove.vercel.app",
     "null",
-]
+)
+ORIGIN_REGEX = r"https://([a-z0-9-]+\.)*matheussilvano\.dev"
+
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=origins, allow_credentials=True,
+    allow_origins=ORIGINS, allow_origin_regex=ORIGIN_REGEX, allow_credentials=True,
     allow_methods=["GET", "POST", "OPTIONS"], allow_headers=["*"],
 )
+# Comprime respostas JSON maiores; os streams SSE passam direto (Content-Encoding: identity)
+app.add_middleware(GZipMiddleware, minimum_size=1000)
 
 # ------------------------------------------------------------------
 # Tipos
@@ -67,56 +148,261 @@ class ConsultaAtlasRequest(BaseModel):
 # Local mode (equipe.json) — como era antes
 # ------------------------------------------------------------------
 EQUIPE_JSON_PATH = Path(__file__).parent / "equipe.json"
-try:
-    equipe_data = json.loads(EQUIPE_JSON_PATH.read_text(encoding="utf-8"))
-except Exception:
-    equipe_data = {}
+EQUIPE_RELOAD_INTERVALO = 30  # segundos entre checagens de mtime
+
+_equipe_mtime: Optional[float] = None
+# Cada membro serializado uma única vez por versão do equipe.json
+_membros_json: list[str] = []
+
+def _load_equipe() -> bool:
+    """
+    (Re)carrega equipe.json se o mtime mudou. Retorna True quando os dados mudaram.
+    Em caso de erro, mantém a última versão válida e registra o motivo no log.
+    """
+    global _equipe_mtime, _membros_json
+
+    try:
+        mtime = EQUIPE_JSON_PATH.stat().st_mtime
+    except FileNotFoundError:
+        logger.warning("equipe.json não encontrado em %s", EQUIPE_JSON_PATH)
+        return False
+    except OSError as e:
+        logger.error("Falha ao acessar equipe.json: %s", e)
+        return False
+    if mtime == _equipe_mtime:
+        return False
+
+    try:
+        data = orjson.loads(EQUIPE_JSON_PATH.read_bytes())
+    except (OSError, orjson.JSONDecodeError) as e:
+        logger.error("Falha ao carregar equipe.json: %s", e)
+        return False
+
+    membros = data.get("equipe", []) if isinstance(data, dict) else []
+    _membros_json = [orjson.dumps(m, option=orjson.OPT_INDENT_2).decode() for m in membros]
+    _equipe_mtime = mtime
+    return True
+
+_load_equipe()
+
+# ------------------------------------------------------------------
+# Índice de embeddings (um vetor por membro da equipe)
+# ------------------------------------------------------------------
+EMBEDDING_MODEL = "text-embedding-3-small"
+EMBEDDING_TOP_K = 5
+# Abaixo disso a equipe inteira cabe no prompt: busca por embeddings só custaria
+# uma chamada a mais e esconderia membros de perguntas sobre a equipe toda
+EMBEDDING_MIN_MEMBROS = 50
+
+# Prompt de sistema fixo e sempre na posição 0: prefixo idêntico entre chamadas
+# permite o cache automático de prompt da OpenAI
+_SYSTEM = (
+    "Você é um assistente inteligente especializado em perfis de equipe. "
+    "Você conhece todos os membros da equipe Atlas.AI e, junto com cada pergunta, "
+    "recebe em formato JSON os dados da equipe (ou dos membros mais relevantes, se ela for grande).\n\n"
+    "Com base nisso, responda à pergunta do usuário. "
+    "Se for sobre quem tem experiência em algo ou quem é mais indicado para uma vaga, "
+    "diga o(s) nome(s) e justifique de forma breve e clara, explicando o porquê da escolha. "
+    "Sempre use informações reais do JSON. "
+    "Responda em português e de forma natural."
+)
+_SYSTEM_MESSAGE = {"role": "system", "content": _SYSTEM}
+
+# (textos, vetores): o índice vale só para a lista de textos com que foi gerado
+_indice_membros: Optional[tuple[list[str], np.ndarray]] = None
+_indice_membros_lock = asyncio.Lock()
+
+def _normalizar(vetores: np.ndarray) -> np.ndarray:
+    normas = np.linalg.norm(vetores, axis=1, keepdims=True)
+    return vetores / np.where(normas == 0, 1, normas)
+
+async def _embed(textos: list[str]) -> np.ndarray:
+    resp = await client.embeddings.create(model=EMBEDDING_MODEL, input=textos)
+    return _normalizar(np.array([d.embedding for d in resp.data], dtype=np.float32))
+
+async def _obter_indice_membros(textos: list[str]) -> np.ndarray:
+    """
+    Calcula os embeddings da equipe na primeira consulta (ou após um reload) e reaproveita depois.
+    """
+    global _indice_membros
+    indice = _indice_membros
+    if indice is None or indice[0] is not textos:
+        async with _indice_membros_lock:
+            indice = _indice_membros
+            if indice is None or indice[0] is not textos:
+                indice = (textos, await _embed(textos))
+                _indice_membros = indice
+    return indice[1]
+
+async def selecionar_membros(pergunta: str) -> list[str]:
+    """
+    Retorna o JSON de todos os membros ou, em equipes com EMBEDDING_MIN_MEMBROS
+    ou mais, dos EMBEDDING_TOP_K mais similares à pergunta.
+    """
+    textos = _membros_json
+    if len(textos) < EMBEDDING_MIN_MEMBROS:
+        return textos
+
+    vetores = await _obter_indice_membros(textos)
+    q = (await _embed([pergunta]))[0]
+    scores = vetores @ q  # similaridade de cosseno (vetores já normalizados)
+    # Ordem original do equipe.json: o mesmo conjunto de membros gera sempre o mesmo prompt
+    top = np.sort(np.argsort(scores)[::-1][:EMBEDDING_TOP_K])
+    return [textos[i] for i in top]
 
-def gerar_resposta(pergunta: str) -> str:
+async def gerar_resposta(pergunta: str):
     """
-    Consulta local: injeta o JSON no prompt e usa chat.completions.
+    Consulta local: seleciona os membros (via embeddings em equipes grandes), injeta no prompt
+    e faz streaming dos pedaços de texto gerados por chat.completions.
     """
-    if not equipe_data:
+    if not _membros_json:
         raise RuntimeError("equipe.json não encontrado ou vazio ao tentar responder localmente.")
 
+    membros = await selecionar_membros(pergunta)
     contexto = (
-        "Você é um assistente que conhece todos os membros da equipe Atlas.AI.\n"
-        "Abaixo estão os dados da equipe em formato JSON:\n\n"
-        f"{json.dumps(equipe_data, ensure_ascii=False, indent=2)}\n\n"
-        "Com base nisso, responda à pergunta do usuário. "
-        "Se for sobre quem tem experiência em algo ou quem é mais indicado para uma vaga, "
-        "diga o(s) nome(s) e justifique de forma breve e clara, explicando o porquê da escolha. "
-        "Sempre use informações reais do JSON. "
-        "Responda em português e de forma natural.\n\n"
-        f"Pergunta: {pergunta}"
+        "Dados dos membros da equipe:\n\n"
+        + "\n\n".join(membros)
+        + f"\n\nPergunta: {pergunta}"
     )
 
-    completion = client.chat.completions.create(
+    stream = await client.chat.completions.create(
         model="gpt-4o-mini",
         messages=[
-            {"role": "system", "content": "Você é um assistente inteligente especializado em perfis de equipe."},
+            _SYSTEM_MESSAGE,
             {"role": "user", "content": contexto},
         ],
         temperature=0.7,
+        stream=True,
     )
-    return completion.choices[0].message.content
+    async for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
 
 # ------------------------------------------------------------------
-# Endpoint 1: /consulta-atlas (LOCAL, sem streaming)
+# Cache de respostas (single-flight + TTL)
+# ------------------------------------------------------------------
+RESPOSTA_CACHE_TTL = 600  # segundos
+
+# (mtime do equipe.json, hash da pergunta): respostas geradas com uma versão
+# antiga da equipe nunca são servidas depois de um reload
+_ChaveResposta = tuple[Optional[float], bytes]
+
+class _RespostaEmAndamento:
+    """
+    Resposta sendo gerada por uma única chamada à OpenAI. Todos os clientes
+    com a mesma pergunta acompanham os mesmos pedaços de texto.
+    """
+
+    def __init__(self, chave: _ChaveResposta, pergunta: str):
+        self.partes: list[str] = []
+        self.erro: Optional[Exception] = None
+        self.concluida = False
+        self._mudou = asyncio.Condition()
+        # Task própria: um cliente que desconecta não cancela a geração dos demais
+        self.task = asyncio.create_task(self._produzir(chave, pergunta))
+
+    async def _produzir(self, chave: _ChaveResposta, pergunta: str):
+        try:
+            async for parte in gerar_resposta(pergunta):
+                async with self._mudou:
+                    self.partes.append(parte)
+                    self._mudou.notify_all()
+        except Exception as e:
+            self.erro = e
+        finally:
+            _respostas_em_andamento.pop(chave, None)
+            async with self._mudou:
+                self.concluida = True
+                self._mudou.notify_all()
+
+        if self.erro is None:
+            _respostas_cache[chave] = "".join(self.partes)
+
+    async def acompanhar(self):
+        i = 0
+        while True:
+            async with self._mudou:
+                await self._mudou.wait_for(lambda: i < len(self.partes) or self.concluida)
+                novas = self.partes[i:]
+                concluida = self.concluida
+            i += len(novas)
+            for parte in novas:
+                yield parte
+            if concluida:
+                if self.erro is not None:
+                    raise self.erro
+                return
+
+_respostas_cache: TTLCache = TTLCache(maxsize=1024, ttl=RESPOSTA_CACHE_TTL)
+_respostas_em_andamento: dict[_ChaveResposta, _RespostaEmAndamento] = {}
+
+async def gerar_resposta_cacheada(pergunta: str):
+    """
+    Perguntas idênticas compartilham a mesma chamada à OpenAI enquanto ela
+    está em andamento, e a resposta fica em cache por RESPOSTA_CACHE_TTL.
+    """
+    chave = (_equipe_mtime, hashlib.blake2b(pergunta.encode("utf-8")).digest())
+    # get() em vez de "in" + []: a entrada pode expirar entre as duas operações
+    resposta = _respostas_cache.get(chave)
+    if resposta is not None:
+        yield resposta
+        return
+
+    em_andamento = _respostas_em_andamento.get(chave)
+    if em_andamento is None:
+        em_andamento = _respostas_em_andamento[chave] = _RespostaEmAndamento(chave, pergunta)
+
+    async for parte in em_andamento.acompanhar():
+        yield parte
+
+# ------------------------------------------------------------------
+# Reload do equipe.json em background
+# ------------------------------------------------------------------
+async def _recarregar_equipe_periodicamente():
+    while True:
+        await asyncio.sleep(EQUIPE_RELOAD_INTERVALO)
+        try:
+            if _load_equipe():
+                _respostas_cache.clear()
+                logger.info("equipe.json recarregado (%d membros)", len(_membros_json))
+        except Exception:
+            # Um erro inesperado não pode encerrar o reload de vez
+            logger.exception("Falha ao recarregar equipe.json")
+
+# ------------------------------------------------------------------
+# Warmup + keep-alive da conexão com a OpenAI
+# ------------------------------------------------------------------
+async def _manter_conexao_openai():
+    # Primeira chamada já no startup: DNS, TLS e HTTP/2 prontos antes do primeiro /ask
+    while True:
+        try:
+            await client.models.list()
+        except Exception as e:
+            logger.warning("Falha no keep-alive da OpenAI: %s", e)
+        await asyncio.sleep(OPENAI_KEEPALIVE_INTERVALO)
+
+# ------------------------------------------------------------------
+# Endpoint 1: /consulta-atlas (LOCAL, com streaming SSE)
 # ------------------------------------------------------------------
 @app.post(
     "/consulta-atlas",
     summary="Consulta local à Atlas.AI (equipe.json)",
-    description="Lê equipe.json e responde via chat.completions (sem streaming)."
+    description="Lê equipe.json e faz streaming da resposta de chat.completions via SSE."
 )
 async def consulta_atlas_local(req: ConsultaAtlasRequest):
-    try:
-        answer = gerar_resposta(req.pergunta)
-        return {"answer": answer, "mode": "local-json"}
-    except RuntimeError as e:
-        raise HTTPException(status_code=400, detail=str(e))
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Falha ao gerar resposta local: {e}")
+    if not _membros_json:
+        raise HTTPException(status_code=400, detail="equipe.json não encontrado ou vazio ao tentar responder localmente.")
+
+    async def stream_generator():
+        yield b"data: " + orjson.dumps({"event": "mode", "data": "local-json"}) + b"\n\n"
+        try:
+            async for parte in gerar_resposta_cacheada(req.pergunta):
+                yield _CHUNK_PREFIX + orjson.dumps(parte) + _CHUNK_SUFFIX
+        except Exception as e:
+            # Status HTTP já foi enviado: o erro segue como evento no stream
+            yield b"data: " + orjson.dumps({"event": "error", "data": f"Falha ao gerar resposta local: {e}"}) + b"\n\n"
+
+    return StreamingResponse(stream_generator(), headers=_SSE_HEADERS)
 
 # ------------------------------------------------------------------
 # Endpoint 2: /ask (Assistants API com streaming SSE)
@@ -130,80 +416,91 @@ async def ask_assistant_streaming(req: AskRequest):
     if not ASSISTANT_ID:
         raise HTTPException(status_code=400, detail="ASSISTANT_ID não definido no .env para usar /ask.")
 
-    thread_id = req.thread_id
-    try:
-        if thread_id is None:
-            thread = client.beta.threads.create()
-            thread_id = thread.id
-
-        client.beta.threads.messages.create(
-            thread_id=thread_id,
-            role="user",
-            content=req.question
-        )
+    user_message = {"role": "user", "content": req.question}
 
-        async def stream_generator():
-            # Manda o thread_id primeiro (para o front-end guardar)
-            yield "data: " + json.dumps({"event": "thread_id", "data": thread_id}) + "\n\n"
+    async def stream_generator():
+        citacoes = _FiltroCitacoes()
+        try:
+            if req.thread_id is None:
+                # Cria a thread, adiciona a mensagem e inicia o run numa única chamada
+                run_stream = client.beta.threads.create_and_run_stream(
+                    assistant_id=ASSISTANT_ID,
+                    thread={"messages": [user_message]},
+                )
+            else:
+                # Manda o thread_id primeiro (para o front-end guardar)
+                yield b"data: " + orjson.dumps({"event": "thread_id", "data": req.thread_id}) + b"\n\n"
+                # Adiciona a mensagem e inicia o run numa única chamada
+                run_stream = client.beta.threads.runs.stream(
+                    thread_id=req.thread_id,
+                    assistant_id=ASSISTANT_ID,
+                    additional_messages=[user_message],
+                )
 
             # Stream do run
-            with client.beta.threads.runs.stream(
-                thread_id=thread_id,
-                assistant_id=ASSISTANT_ID,
-            ) as stream:
-                for event in stream:
-                    if event.event == "thread.message.delta":
+            async with run_stream as stream:
+                async for event in stream:
+                    if event.event == "thread.created":
+                        yield b"data: " + orjson.dumps({"event": "thread_id", "data": event.data.id}) + b"\n\n"
+
+                    elif event.event == "thread.message.delta":
                         if event.data.delta.content:
                             text_chunk = event.data.delta.content[0].text.value
-                            cleaned = re.sub(r'【.*?】', '', text_chunk)
+                            cleaned = citacoes.adicionar(text_chunk)
                             if cleaned:
-                                yield "data: " + json.dumps({"event": "text_chunk", "data": cleaned}) + "\n\n"
+                                yield _CHUNK_PREFIX + orjson.dumps(cleaned) + _CHUNK_SUFFIX
 
                     elif event.event == "thread.run.requires_action":
+                        cleaned = citacoes.liberar()
+                        if cleaned:
+                            yield _CHUNK_PREFIX + orjson.dumps(cleaned) + _CHUNK_SUFFIX
+
                         # Se seu Assistant chamar tools personalizadas, trate aqui.
-                        run_id = event.data.id
-                        tool_calls = event.data.required_action.submit_tool_outputs.tool_calls
+                        run = event.data
+                        tool_calls = run.required_action.submit_tool_outputs.tool_calls
                         tool_outputs = []
 
                         # Exemplo: navegar no front
                         for call in tool_calls:
                             if call.function.name == "navigateToSection":
-                                args = json.loads(call.function.arguments)
-                                yield "data: " + json.dumps({"event": "tool_call", "data": {"name": "navigateToSection", "arguments": args}}) + "\n\n"
+                                args = orjson.loads(call.function.arguments)
+                                yield b"data: " + orjson.dumps({"event": "tool_call", "data": {"name": "navigateToSection", "arguments": args}}) + b"\n\n"
                                 tool_outputs.append({
                                     "tool_call_id": call.id,
-                                    "output": json.dumps({"success": True})
+                                    "output": orjson.dumps({"success": True}).decode()
                                 })
 
                         if tool_outputs:
-                            with client.beta.threads.runs.submit_tool_outputs_stream(
-                                thread_id=thread_id,
-                                run_id=run_id,
+                            async with client.beta.threads.runs.submit_tool_outputs_stream(
+                                thread_id=run.thread_id,
+                                run_id=run.id,
                                 tool_outputs=tool_outputs,
                             ) as follow_stream:
-                                for part in follow_stream:
+                                async for part in follow_stream:
                                     if part.event == "thread.message.delta":
                                         if part.data.delta.content:
                                             text_chunk = part.data.delta.content[0].text.value
-                                            cleaned = re.sub(r'【.*?】', '', text_chunk)
+                                            cleaned = citacoes.adicionar(text_chunk)
                                             if cleaned:
-                                                yield "data: " + json.dumps({"event": "text_chunk", "data": cleaned}) + "\n\n"
+                                                yield _CHUNK_PREFIX + orjson.dumps(cleaned) + _CHUNK_SUFFIX
 
-        headers = {
-            "Content-Type": "text/event-stream",
-            "Cache-Control": "no-cache",
-            "Connection": "keep-alive",
-            "X-Accel-Buffering": "no",
-            "Content-Encoding": "identity",
-        }
-        return StreamingResponse(stream_generator(), headers=headers)
+            cleaned = citacoes.liberar()
+            if cleaned:
+                yield _CHUNK_PREFIX + orjson.dumps(cleaned) + _CHUNK_SUFFIX
 
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Erro no /ask: {e}")
+        except Exception as e:
+            # Status HTTP já foi enviado: o erro segue como evento no stream
+            yield b"data: " + orjson.dumps({"event": "error", "data": f"Erro no /ask: {e}"}) + b"\n\n"
+
+    return StreamingResponse(stream_generator(), headers=_SSE_HEADERS)
 
 # ------------------------------------------------------------------
-# Root
+# Root + health check
 # ------------------------------------------------------------------
 @app.get("/", include_in_schema=False)
 def root():
     return {"message": "Atlas.AI API ativa. Veja /docs."}
+
+@app.get("/healthz", include_in_schema=False)
+def healthz():
+    return {"status": "ok"}